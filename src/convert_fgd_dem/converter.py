@@ -1,5 +1,6 @@
 import os
-import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -10,6 +11,17 @@ from .geotiff import Geotiff
 
 from PyQt5.QtCore import QThread, pyqtSignal
 
+# Output arrays larger than this are backed by a scratch file instead of RAM
+MEMMAP_THRESHOLD_BYTES = 512 * 1024 * 1024
+
+# Write GeoTiff in 512x512 blocks with lossless compression
+TILED_CREATION_OPTIONS = [
+    "TILED=YES",
+    "BLOCKXSIZE=512",
+    "BLOCKYSIZE=512",
+    "COMPRESS=DEFLATE",
+]
+
 
 class Converter(QThread):
     # thread signals to plugin progress dialog
@@ -57,6 +69,7 @@ class Converter(QThread):
 
         self.sea_at_zero = sea_at_zero
         self.dem = None  # to be populate with Dem class in "run" main function
+        self._scratch_file = None  # backing file of a memory-mapped output array
 
         self.process_interrupted = False
 
@@ -73,43 +86,87 @@ class Converter(QThread):
         x_length = round(
             abs(
                 (upper_right_lon - lower_left_lon)
-                / self.dem.meta_data_list[0]["pixel_size"]["x"]
+                / float(self.dem.meta_data_array["pixel_size_x"][0])
             )
         )
         y_length = round(
             abs(
                 (upper_right_lat - lower_left_lat)
-                / self.dem.meta_data_list[0]["pixel_size"]["y"]
+                / float(self.dem.meta_data_array["pixel_size_y"][0])
             )
         )
 
         return x_length, y_length
 
-    def _combine_meta_data_and_contents(self):
-        """Combine metadata and elevation values ​​with the same mesh code
+    def _allocate_dem_array(self, x_length, y_length):
+        """Allocate the array covering all xml, memory-mapped to a scratch file when it is large
+
+        Args:
+            x_length (int): image size of x
+            y_length (int): image size of y
 
         Returns:
-            list: Mesh data list
+            numpy.ndarray: Uninitialized float32 array of shape (y_length, x_length)
         """
-        mesh_data_list = []
+        shape = (y_length, x_length)
+        if x_length * y_length * np.dtype(np.float32).itemsize < MEMMAP_THRESHOLD_BYTES:
+            return np.empty(shape, np.float32)
+
+        # Next to the output rather than in the system temp directory, which may be held in RAM
+        self.output_path.mkdir(exist_ok=True)
+        self._scratch_file = tempfile.TemporaryFile(suffix=".dat", dir=self.output_path)
+        return np.memmap(self._scratch_file, dtype=np.float32, mode="w+", shape=shape)
+
+    def _close_scratch_file(self):
+        """Close the scratch file of the memory-mapped array, the OS deletes it once unmapped"""
+        if self._scratch_file is not None:
+            self._scratch_file.close()
+            self._scratch_file = None
+
+    @staticmethod
+    def _fill_uncovered(dem_array, row_starts, row_ends, column_starts, column_ends):
+        """Fill the cells outside all xml ranges with no data
 
-        sort_metadata_list = sorted(
-            self.dem.meta_data_list, key=lambda x: x["mesh_code"]
+        The coverage is tracked on the grid formed by the edges of the xml ranges,
+        which is far smaller than the image, as xml are aligned on mesh boundaries.
+
+        Args:
+            dem_array (numpy.ndarray): Array covering all xml
+            row_starts (numpy.ndarray): First row of each xml
+            row_ends (numpy.ndarray): Row after the last one of each xml
+            column_starts (numpy.ndarray): First column of each xml
+            column_ends (numpy.ndarray): Column after the last one of each xml
+        """
+        y_length, x_length = dem_array.shape
+        row_edges = np.unique(
+            np.clip(np.concatenate(([0, y_length], row_starts, row_ends)), 0, y_length)
         )
-        sort_contents_list = sorted(
-            self.dem.np_array_list, key=lambda x: x["mesh_code"]
+        column_edges = np.unique(
+            np.clip(
+                np.concatenate(([0, x_length], column_starts, column_ends)), 0, x_length
+            )
         )
-        for metadata, content in zip(sort_metadata_list, sort_contents_list):
-            metadata.update(content)
-            mesh_data_list.append(metadata)
 
-        return mesh_data_list
+        covered = np.zeros((row_edges.size - 1, column_edges.size - 1), dtype=bool)
+        for row_start, row_end, column_start, column_end in zip(
+            np.searchsorted(row_edges, row_starts).tolist(),
+            np.searchsorted(row_edges, row_ends).tolist(),
+            np.searchsorted(column_edges, column_starts).tolist(),
+            np.searchsorted(column_edges, column_ends).tolist(),
+        ):
+            covered[row_start:row_end, column_start:column_end] = True
+
+        for row, column in zip(*np.nonzero(~covered)):
+            dem_array[
+                row_edges[row] : row_edges[row + 1],
+                column_edges[column] : column_edges[column + 1],
+            ] = -9999
 
     def make_data_for_geotiff(self):
         """Generate the data required to create GeoTiff from Dem information
 
         Returns:
-            tuple: Geo transform list, dem numpy array, image size of x, y and output path
+            tuple: Geo transform list, dem numpy array, image size of x, y, output path and GTiff creation options
         """
         # Number of grid cells including all xml
         image_size = self._calc_image_size()
@@ -124,8 +181,7 @@ class Converter(QThread):
             raise Exception(error_message)
 
         # Create an array that covers all xml
-        dem_array = np.empty((y_length, x_length), np.float32)
-        dem_array.fill(-9999)
+        dem_array = self._allocate_dem_array(x_length, y_length)
 
         x_pixel_size = (
             self.dem.bounds_latlng["upper_right"]["lon"]
@@ -136,34 +192,39 @@ class Converter(QThread):
             - self.dem.bounds_latlng["upper_right"]["lat"]
         ) / y_length
 
-        # Combine metadata and elevation values
-        data_list = self._combine_meta_data_and_contents()
-
-        for data in data_list:
-            # Get the bottom left coordinates of the read array
-            lower_left_lat = data["lower_corner"]["lat"]
-            lower_left_lon = data["lower_corner"]["lon"]
-
-            # Calculate the distance from (0, 0)
-            lat_distance = lower_left_lat - self.dem.bounds_latlng["lower_left"]["lat"]
-            lon_distance = lower_left_lon - self.dem.bounds_latlng["lower_left"]["lon"]
-
-            # Get coordinates on numpy (Rounded off to eliminate errors)
-            x_coordinate = round(lon_distance / x_pixel_size)
-            y_coordinate = round(lat_distance / (-y_pixel_size))
-
-            x_len = data["grid_length"]["x"]
-            y_len = data["grid_length"]["y"]
+        # Calculate the distance of the bottom left of each xml from (0, 0)
+        meta_data_array = self.dem.meta_data_array
+        lat_distances = (
+            meta_data_array["lower_lat"] - self.dem.bounds_latlng["lower_left"]["lat"]
+        )
+        lon_distances = (
+            meta_data_array["lower_lon"] - self.dem.bounds_latlng["lower_left"]["lon"]
+        )
 
-            row_start = int(y_length - (y_coordinate + y_len))
-            row_end = int(row_start + y_len)
-            column_start = int(x_coordinate)
-            column_end = int(column_start + x_len)
+        # Get coordinates on numpy (Rounded off to eliminate errors)
+        x_coordinates = np.round(lon_distances / x_pixel_size).astype(np.int64)
+        y_coordinates = np.round(lat_distances / (-y_pixel_size)).astype(np.int64)
+
+        # Array ranges of all xml, the loop below only performs the copies
+        row_starts = y_length - (y_coordinates + meta_data_array["grid_y"])
+        row_ends = row_starts + meta_data_array["grid_y"]
+        column_starts = x_coordinates
+        column_ends = column_starts + meta_data_array["grid_x"]
+
+        for tile, row_start, row_end, column_start, column_end in zip(
+            self.dem.tile_list,
+            row_starts.tolist(),
+            row_ends.tolist(),
+            column_starts.tolist(),
+            column_ends.tolist(),
+        ):
+            # Assign the elevation values to a large array
+            np.copyto(
+                dem_array[row_start:row_end, column_start:column_end], tile["np_array"]
+            )
 
-            # Get an array of elevation values ​​from the data
-            np_array = data["np_array"]
-            # Assign to a large array
-            dem_array[row_start:row_end, column_start:column_end] = np_array
+        # Only the cells not written by any xml are filled with no data
+        self._fill_uncovered(dem_array, row_starts, row_ends, column_starts, column_ends)
 
         geo_transform = [
             self.dem.bounds_latlng["lower_left"]["lon"],
@@ -174,12 +235,17 @@ class Converter(QThread):
             y_pixel_size,
         ]
 
+        # Floating point predictor for elevation, horizontal differencing for Terrain RGB bytes
+        predictor = "PREDICTOR=2" if self.rgbify else "PREDICTOR=3"
+        creation_options = TILED_CREATION_OPTIONS + [predictor]
+
         data_for_geotiff = (
             geo_transform,
             dem_array,
             x_length,
             y_length,
             self.output_path,
+            creation_options,
         )
         return data_for_geotiff
 
@@ -201,17 +267,18 @@ class Converter(QThread):
                 progress_message = "Converting XML files to GeoTIFF DEM..."
             self.postMessage.emit(progress_message)
 
-            for xml_path in self.dem.xml_paths:
-                self.dem.all_content_list.append(self.dem.get_xml_content(xml_path))
-                self.addProgress.emit(1)
+            # Each xml is independent, parse them concurrently and keep the input order
+            with ThreadPoolExecutor() as executor:
+                for content in executor.map(
+                    self.dem.get_xml_content, self.dem.xml_paths
+                ):
+                    self.dem.all_content_list.append(content)
+                    self.addProgress.emit(1)
 
             # Stop process if output is a whole no data dem
-            is_nodata_dem = True
-            for content in self.dem.all_content_list:
-                items = content["elevation"]["items"]
-                if any(item != "-9999." for item in items):
-                    is_nodata_dem = False
-                    break
+            is_nodata_dem = not any(
+                content["has_data"] for content in self.dem.all_content_list
+            )
 
             if is_nodata_dem:
                 self.processFailed.emit("Output DEM has no elevation data.")
@@ -221,10 +288,12 @@ class Converter(QThread):
             if self.process_interrupted:
                 return
 
-            self.postMessage.emit("Creating TIFF file...")
-
             # convert Dem contents to array
             self.dem.contents_to_array()
+            # Keep the contents for a conversion of the same input
+            self.dem.update_cache()
+
+            self.postMessage.emit("Creating TIFF file...")
 
             data_for_geotiff = self.make_data_for_geotiff()
 
@@ -257,20 +326,9 @@ class Converter(QThread):
             # emit error for plugin
             self.processFailed.emit(str(e))
             raise Exception(e) from e
-
-        # Remove extracted directory from ZIP file
-        if self.import_path.suffix == ".zip":
-            extract_dir = self.import_path.parent / self.import_path.stem
-            shutil.rmtree(extract_dir)
-        elif self.import_path.suffix == '.zip"':
-            zip_paths = str(self.import_path).split('" "')
-            zip_paths = [
-                Path(zip_path.strip('"'))
-                for zip_path in zip_paths
-                if (zip_path.endswith(".zip") or zip_path.endswith('.zip"'))
-            ]
-            for zip_file in zip_paths:
-                extract_dir = zip_file.parent / zip_file.stem
-                shutil.rmtree(extract_dir)
+        finally:
+            self._close_scratch_file()
+            if self.dem is not None:
+                self.dem.close()
 
         self.processFinished.emit()
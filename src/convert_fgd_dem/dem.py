@@ -1,13 +1,73 @@
+import io
+import mmap
 import os
-import shutil
-import xml.etree.ElementTree as et
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
 import numpy as np
 
 from .helpers import DemInputXmlException
 
+# Namespaces in Clark notation, as they appear in parsed tags
+DATASET_NAME_SPACE = "{http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema}"
+GML_NAME_SPACE = "{http://www.opengis.net/gml/3.2}"
+
+# Tags of the elements read from each DEM, and their keys
+ELEMENT_KEYS = {
+    f"{DATASET_NAME_SPACE}mesh": "mesh_code",
+    f"{GML_NAME_SPACE}lowerCorner": "lower_corner",
+    f"{GML_NAME_SPACE}upperCorner": "upper_corner",
+    f"{GML_NAME_SPACE}high": "grid_length",
+    f"{GML_NAME_SPACE}startPoint": "start_point",
+    f"{GML_NAME_SPACE}tupleList": "tuple_list",
+}
+
+try:
+    from lxml import etree as et
+
+    # Only the wanted elements are returned from libxml2, blank text nodes are dropped.
+    # huge_tree lifts the size limit of a text node, which a large tupleList exceeds.
+    ITERPARSE_OPTIONS = {
+        "tag": list(ELEMENT_KEYS),
+        "remove_blank_text": True,
+        "huge_tree": True,
+    }
+except ImportError:
+    import xml.etree.ElementTree as et
+
+    ITERPARSE_OPTIONS = {}
+
+# Metadata of all DEM as a structured array, one record per xml
+META_DATA_DTYPE = np.dtype(
+    [
+        ("mesh_code", "i8"),
+        ("lower_lat", "f8"),
+        ("lower_lon", "f8"),
+        ("upper_lat", "f8"),
+        ("upper_lon", "f8"),
+        ("grid_x", "i4"),
+        ("grid_y", "i4"),
+        ("start_x", "i4"),
+        ("start_y", "i4"),
+        ("pixel_size_x", "f8"),
+        ("pixel_size_y", "f8"),
+    ]
+)
+
+# Categories of sea area in tupleList, e.g. "海水面,-9999."
+SEA_CATEGORIES = ["海水面", "海水底面"]
+
+# Contents of the xml of the last converted input, reused when the same files are converted again.
+# The input is kept or dropped as a whole, a partial cache would be evicted in reading order before any hit.
+# Bounded since it stays in memory between conversions, e.g. a 5m mesh ZIP of 100 tiles holds about 13.5MB
+# of elevation values and a 10m mesh tile about 3.4MB.
+CONTENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_content_cache = {}
+_content_cache_lock = threading.Lock()
+
 
 class Dem:
     """Retrieve metadata from DEM xml"""
@@ -24,59 +84,63 @@ class Dem:
             "Content" refers to mesh code, metadata, and elevation values.
         """
         self.import_path: Path = import_path
-        self.xml_paths: list = self._get_xml_paths()
+        self.zip_files: list = []  # input ZIP files, xml are read from them without extracting
+        try:
+            self.xml_paths: list = self._get_xml_paths()
+        except Exception:
+            # The caller never gets this instance, close the archives opened so far
+            self.close()
+            raise
 
         self.all_content_list: list = []
         self.mesh_code_list: list = []
-        self.meta_data_list: list = []
+        self.meta_data_array: np.ndarray = np.empty(0, META_DATA_DTYPE)
         self.sea_at_zero = sea_at_zero
+        self._read_contents: dict = {}  # contents read by get_xml_content, by cache key
 
     def contents_to_array(self):
         self._get_metadata_list()
-        self.np_array_list: list = []
-        self._store_np_array_list()
+        self.tile_list: list = []
+        self._store_tile_list()
 
         self.bounds_latlng: dict = {}
         self._store_bounds_latlng()
 
-    def _unzip_dem(self, zip_file, dest_dir):
-        """Unzip the zip file containing the DEM
+    def close(self):
+        """Close the input ZIP files"""
+        for zip_file in self.zip_files:
+            zip_file.close()
+        self.zip_files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_zip_xml_paths(self, zip_path):
+        """Open the ZIP file containing the DEM and list its xml
 
         Args:
-            dest_dir (Path): Path object of unzip directory
+            zip_path (Path): Path object of ZIP file
+
+        Returns:
+            list: List containing zipfile.Path of each xml, read in memory without extracting
         """
-        with zipfile.ZipFile(zip_file, "r") as zip_data:
-            zip_data.extractall(path=dest_dir)
-            # Delete unnecessary files created when macOS
-            garbage_dir = dest_dir / "__MACOSX"
-            if garbage_dir.exists():
-                shutil.rmtree(garbage_dir)
-
-            # If the directory with the same name is not created in the unzipped directory, return
-            if dest_dir.glob(".xml"):
-                return
-
-            # If not, retrieve it from subdirectory
-            for path in zip_data.namelist():
-                if path.endswith(".xml"):
-                    try:
-                        shutil.move(dest_dir / path, dest_dir)
-                    except shutil.Error:
-                        print(
-                            f"ファイルがすでに存在しています。"
-                            f"ファイルの移動をスキップし、オリジナルファイルを削除します：{dest_dir / path}"
-                        )
-                        os.remove(dest_dir / path)
-                        continue
-            # Deleted the directory with the same name as the parent folder
-            if (dest_dir / zip_file.stem).exists():
-                (dest_dir / zip_file.stem).rmdir()
+        zip_file = zipfile.ZipFile(zip_path, "r")
+        self.zip_files.append(zip_file)
+        return [
+            zipfile.Path(zip_file, name)
+            for name in zip_file.namelist()
+            # Skip unnecessary files created when macOS
+            if name.endswith(".xml") and not name.startswith("__MACOSX/")
+        ]
 
     def _get_xml_paths(self):
         """Create a list of xml Path objects from the specified path
 
         Returns:
-            list: List containing xml paths
+            list: List containing xml paths, zipfile.Path for xml in ZIP file
 
         """
 
@@ -91,17 +155,20 @@ class Dem:
             ]
 
         elif self.import_path.is_dir():
-            xml_paths = [xml_path for xml_path in self.import_path.glob("*.xml")]
-            if xml_paths is None or len(xml_paths) == 0:
+            with os.scandir(self.import_path) as entries:
+                xml_paths = [
+                    Path(entry.path)
+                    for entry in entries
+                    if entry.name.endswith(".xml") and entry.is_file()
+                ]
+            if len(xml_paths) == 0:
                 raise DemInputXmlException("No XML file found in input folder.")
 
         elif self.import_path.suffix == ".xml":
             xml_paths = [self.import_path]
 
         elif self.import_path.suffix == ".zip":
-            extract_dir = self.import_path.parent / self.import_path.stem
-            self._unzip_dem(self.import_path, extract_dir)
-            xml_paths = [xml_path for xml_path in extract_dir.rglob("*.xml")]
+            xml_paths = self._get_zip_xml_paths(self.import_path)
             if not xml_paths:
                 raise DemInputXmlException("No XML file found in input zip file.")
 
@@ -116,10 +183,7 @@ class Dem:
 
             xml_paths = []
             for zip_path in zip_paths:
-                extract_dir = zip_path.parent / zip_path.stem
-                self._unzip_dem(zip_path, extract_dir)
-                for xml_path in extract_dir.rglob("*.xml"):
-                    xml_paths.append(xml_path)
+                xml_paths.extend(self._get_zip_xml_paths(zip_path))
 
             if len(xml_paths) == 0:
                 raise DemInputXmlException("No XML file found in input zip file.")
@@ -139,117 +203,201 @@ class Dem:
             raw_metadata (dict): A dictionary containing raw metadata retrieved from xml
 
         Returns:
-            dict: A dictionary containing processed metadata
+            numpy.void: A record of META_DATA_DTYPE containing processed metadata
 
         """
-        lowers = raw_metadata["lower_corner"].split(" ")
-        lower_corner = {"lat": float(lowers[0]), "lon": float(lowers[1])}
-
-        uppers = raw_metadata["upper_corner"].split(" ")
-        upper_corner = {"lat": float(uppers[0]), "lon": float(uppers[1])}
+        lower_lat, lower_lon = map(float, raw_metadata["lower_corner"].split())
+        upper_lat, upper_lon = map(float, raw_metadata["upper_corner"].split())
+        grid_x, grid_y = (int(v) + 1 for v in raw_metadata["grid_length"].split())
+        start_x, start_y = map(int, raw_metadata["start_point"].split())
+
+        meta_data = np.array(
+            (
+                raw_metadata["mesh_code"],
+                lower_lat,
+                lower_lon,
+                upper_lat,
+                upper_lon,
+                grid_x,
+                grid_y,
+                start_x,
+                start_y,
+                (upper_lon - lower_lon) / grid_x,
+                (lower_lat - upper_lat) / grid_y,
+            ),
+            dtype=META_DATA_DTYPE,
+        )[()]
 
-        grids = raw_metadata["grid_length"].split(" ")
-        grid_length = {"x": int(grids[0]) + 1, "y": int(grids[1]) + 1}
+        return meta_data
 
-        start_points = raw_metadata["start_point"].split(" ")
-        start_point = {"x": int(start_points[0]), "y": int(start_points[1])}
+    @staticmethod
+    def _parse_tuple_list(tuple_list, sea_at_zero=False):
+        """Parse the "category,elevation" lines of tupleList in bulk
 
-        pixel_size = {
-            "x": (upper_corner["lon"] - lower_corner["lon"]) / grid_length["x"],
-            "y": (lower_corner["lat"] - upper_corner["lat"]) / grid_length["y"],
-        }
+        Args:
+            tuple_list (str): text of tupleList
+            sea_at_zero (bool): whether to set sea area as 0 (if False, no Data)
 
-        meta_data = {
-            "mesh_code": raw_metadata["mesh_code"],
-            "lower_corner": lower_corner,
-            "upper_corner": upper_corner,
-            "grid_length": grid_length,
-            "start_point": start_point,
-            "pixel_size": pixel_size,
-        }
+        Returns:
+            numpy.ndarray: 1D float32 array of elevation values
+        """
+        if not sea_at_zero:
+            return np.loadtxt(
+                io.StringIO(tuple_list),
+                dtype=np.float32,
+                delimiter=",",
+                usecols=1,
+                ndmin=1,
+                comments=None,
+            )
 
-        return meta_data
+        # Categories are only compared with SEA_CATEGORIES, the longest of which is 4 characters.
+        # Longer ones such as "データなし" are truncated, but never to a sea category.
+        tuples = np.loadtxt(
+            io.StringIO(tuple_list),
+            dtype=[("category", "U4"), ("value", np.float32)],
+            delimiter=",",
+            ndmin=1,
+            comments=None,
+        )
+        values = np.ascontiguousarray(tuples["value"])
+        # replace -9999 by zero if sea_at_zero option is handled
+        is_sea = np.isin(tuples["category"], SEA_CATEGORIES)
+        values[is_sea & (values == -9999)] = 0.0
+        return values
 
     def get_xml_content(self, xml_path):
-        """Read xml to get mesh code, metadata and elevation value
+        """Read xml to get mesh code, metadata and elevation value,
+        reusing the content from the last conversion of the same unmodified file
 
         Args:
-            xml_path (Path): Path object of xml path
+            xml_path (Path or zipfile.Path): Path object of xml path
 
         Returns:
             dict: A dictionary containing mesh code, metadata, and elevation values
         """
-        if not xml_path.suffix == ".xml":
+        if not xml_path.name.endswith(".xml"):
             raise DemInputXmlException("Only XML file format is allowed.")
 
-        name_space = {
-            "dataset": "http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema",
-            "gml": "http://www.opengis.net/gml/3.2",
-        }
-
         try:
-            tree = et.parse(xml_path)
-            root = tree.getroot()
-
-            mesh_code = int(root.find("dataset:DEM//dataset:mesh", name_space).text)
-
-            raw_metadata = {
-                "mesh_code": mesh_code,
-                "lower_corner": root.find(
-                    "dataset:DEM//dataset:coverage//gml:boundedBy//gml:Envelope//gml:lowerCorner",
-                    name_space,
-                ).text,
-                "upper_corner": root.find(
-                    "dataset:DEM//dataset:coverage//gml:boundedBy//gml:Envelope//gml:upperCorner",
-                    name_space,
-                ).text,
-                "grid_length": root.find(
-                    "dataset:DEM//dataset:coverage//gml:gridDomain//gml:Grid//gml:high",
-                    name_space,
-                ).text,
-                "start_point": root.find(
-                    "dataset:DEM//dataset:coverage//gml:coverageFunction//gml:GridFunction//gml:startPoint",
-                    name_space,
-                ).text,
-            }
+            cache_key = self._get_cache_key(xml_path)
+        except OSError:
+            raise DemInputXmlException("Incorrect XML file.")
 
-            meta_data = self._format_metadata(raw_metadata)
+        with _content_cache_lock:
+            content = _content_cache.get(cache_key)
+        if content is None:
+            content = self._read_xml_content(xml_path)
 
-            tuple_list = root.find(
-                "dataset:DEM//dataset:coverage//gml:rangeSet//gml:DataBlock//gml:tupleList",
-                name_space,
-            ).text
+        self._read_contents[cache_key] = content
+        return content
 
-        except Exception:
-            raise DemInputXmlException("Incorrect XML file.")
+    def update_cache(self):
+        """Replace the cached contents with those read for this input, unless they are too large to keep"""
+        cache_bytes = sum(
+            content["elevation"]["values"].nbytes
+            for content in self._read_contents.values()
+        )
+        with _content_cache_lock:
+            _content_cache.clear()
+            if cache_bytes <= CONTENT_CACHE_MAX_BYTES:
+                _content_cache.update(self._read_contents)
 
-        # Create an array list like [352.25,354.15...]
-        if tuple_list.startswith("\n"):
-            tuple_list = tuple_list.strip()
-
-        if self.sea_at_zero:
-            # replace -9999 by zero if sea_at_zero option is handled
-            items = [
-                (
-                    "0.0"
-                    if (
-                        item.split(",")[0] in ["海水面", "海水底面"]
-                        and item.split(",")[1] == "-9999."
-                    )
-                    else item.split(",")[1]
-                )
-                for item in tuple_list.split("\n")
-            ]
+    @staticmethod
+    def clear_cache():
+        """Release the cached contents"""
+        with _content_cache_lock:
+            _content_cache.clear()
+
+    def _get_cache_key(self, xml_path):
+        """Identify the xml by its file, its modification and the options of reading it
 
+        Args:
+            xml_path (Path or zipfile.Path): Path object of xml path
+
+        Returns:
+            tuple: Hashable key of the xml content
+        """
+        if isinstance(xml_path, zipfile.Path):
+            file_path, member = xml_path.root.filename, xml_path.at
         else:
-            items = [item.split(",")[1] for item in tuple_list.split("\n")]
+            file_path, member = xml_path, None
+        stat = os.stat(file_path)
+        return (
+            os.path.abspath(file_path),
+            member,
+            stat.st_mtime_ns,
+            stat.st_size,
+            self.sea_at_zero,
+        )
 
-        elevation = {"mesh_code": mesh_code, "items": items}
+    @staticmethod
+    @contextmanager
+    def _open_xml(xml_path):
+        """Open xml for reading, memory-mapped when it is a file on disk
+
+        Args:
+            xml_path (Path or zipfile.Path): Path object of xml path
+
+        Yields:
+            file object or mmap.mmap: A binary stream of the xml
+        """
+        if isinstance(xml_path, zipfile.Path):
+            # Archive members are decompressed as a stream
+            with xml_path.open("rb") as xml_file:
+                yield xml_file
+            return
+
+        with open(xml_path, "rb") as xml_file, mmap.mmap(
+            xml_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as xml_map:
+            yield xml_map
+
+    def _read_xml_content(self, xml_path):
+        """Parse xml to get mesh code, metadata and elevation value
+
+        Args:
+            xml_path (Path or zipfile.Path): Path object of xml path
+
+        Returns:
+            dict: A dictionary containing mesh code, metadata, and elevation values
+        """
+        try:
+            # Read the elements in a single pass, discarding the others as they are parsed
+            element_texts = {}
+            with self._open_xml(xml_path) as xml_file:
+                for _, element in et.iterparse(
+                    xml_file, events=("end",), **ITERPARSE_OPTIONS
+                ):
+                    key = ELEMENT_KEYS.get(element.tag)
+                    if key is not None:
+                        element_texts[key] = element.text
+                    element.clear()
+                    if len(element_texts) == len(ELEMENT_KEYS):
+                        break
+
+            mesh_code = int(element_texts.pop("mesh_code"))
+            tuple_list = element_texts.pop("tuple_list")
+
+            raw_metadata = {"mesh_code": mesh_code, **element_texts}
+            meta_data = self._format_metadata(raw_metadata)
+
+        except Exception:
+            raise DemInputXmlException("Incorrect XML file.")
+
+        # Create an elevation array like [352.25, 354.15...]
+        values = self._parse_tuple_list(tuple_list, self.sea_at_zero)
+        # The content may be shared between conversions through the cache
+        values.flags.writeable = False
+
+        elevation = {"mesh_code": mesh_code, "values": values}
 
         return {
             "mesh_code": mesh_code,
             "meta_data": meta_data,
             "elevation": elevation,
+            # Whether any of the values is not no data
+            "has_data": bool((values != -9999).any()),
         }
 
     def _check_mesh_codes(self):
@@ -260,47 +408,39 @@ class Dem:
             - Error if the mesh code is other than 6 or 8 digits
             - Error when secondary and tertiary meshes are mixed
         """
-        third_mesh_codes = []
-        second_mesh_codes = []
-
-        for mesh_code in self.mesh_code_list:
-            str_mesh = str(mesh_code)
-            if len(str_mesh) == 6:
-                second_mesh_codes.append(mesh_code)
-            elif len(str_mesh) == 8:
-                third_mesh_codes.append(mesh_code)
-            else:
-                raise DemInputXmlException(
-                    f"Incorrect Mesh code: mesh_code={mesh_code}"
-                )
-
-        if all((third_mesh_codes, second_mesh_codes)):
+        mesh_codes = np.asarray(self.mesh_code_list, dtype=np.int64)
+        # 6 digits for 2nd mesh, 8 digits for 3rd mesh
+        is_second_mesh = (mesh_codes >= 10**5) & (mesh_codes < 10**6)
+        is_third_mesh = (mesh_codes >= 10**7) & (mesh_codes < 10**8)
+
+        incorrect_mesh_codes = mesh_codes[~(is_second_mesh | is_third_mesh)]
+        if incorrect_mesh_codes.size:
+            raise DemInputXmlException(
+                f"Incorrect Mesh code: mesh_code={incorrect_mesh_codes[0]}"
+            )
+
+        if is_second_mesh.any() and is_third_mesh.any():
             raise DemInputXmlException("Mixed mesh format (2nd mesh and 3rd mesh)")
 
     def _get_metadata_list(self):
-        """Create a list of metadata
+        """Create a structured array of metadata in the order of self.all_content_list
         self.all_content_list is populated with elevation data in parent Contents thread
         """
 
         self.mesh_code_list = [item["mesh_code"] for item in self.all_content_list]
         self._check_mesh_codes()
 
-        self.meta_data_list = [item["meta_data"] for item in self.all_content_list]
+        self.meta_data_array = np.array(
+            [item["meta_data"] for item in self.all_content_list],
+            dtype=META_DATA_DTYPE,
+        )
 
     def _store_bounds_latlng(self):
         """対象の全Demから緯度経度の最大・最小値を取得"""
-        lower_left_lat = min(
-            [meta_data["lower_corner"]["lat"] for meta_data in self.meta_data_list]
-        )
-        lower_left_lon = min(
-            [meta_data["lower_corner"]["lon"] for meta_data in self.meta_data_list]
-        )
-        upper_right_lat = max(
-            [meta_data["upper_corner"]["lat"] for meta_data in self.meta_data_list]
-        )
-        upper_right_lon = max(
-            [meta_data["upper_corner"]["lon"] for meta_data in self.meta_data_list]
-        )
+        lower_left_lat = float(self.meta_data_array["lower_lat"].min())
+        lower_left_lon = float(self.meta_data_array["lower_lon"].min())
+        upper_right_lat = float(self.meta_data_array["upper_lat"].max())
+        upper_right_lon = float(self.meta_data_array["upper_lon"].max())
 
         bounds_latlng = {
             "lower_left": {"lat": lower_left_lat, "lon": lower_left_lon},
@@ -310,48 +450,78 @@ class Dem:
         self.bounds_latlng = bounds_latlng
 
     @staticmethod
-    def _get_np_array(content):
+    def _fill_tile(array, values, start_point_x, start_point_y):
+        """Write the elevation values into the tile array from the start point, and no data elsewhere
+
+        Args:
+            array (numpy.ndarray): C-contiguous 2D array of the tile, its contents are overwritten
+            values (numpy.ndarray): 1D array of elevation values
+            start_point_x (int): column of the first value
+            start_point_y (int): row of the first value
+        """
+        flat_array = array.reshape(-1)
+        # Since the data is arranged from the northwest to the southeast,
+        # the values fill the flattened array contiguously from the start point.
+        flat_start = start_point_y * array.shape[1] + start_point_x
+        # The number of rows of data and the size of the grid do not always match
+        count = max(min(values.size, array.size - flat_start), 0)
+
+        # Every cell is written exactly once
+        flat_array[:flat_start] = -9999
+        flat_array[flat_start : flat_start + count] = values[:count]
+        flat_array[flat_start + count :] = -9999
+
+    @staticmethod
+    def _get_np_array(content, array=None):
         """Gets the elevation value from Dem and returns the mesh code and elevation value (np.array)
 
         Args:
             content(dict): Dictionary containing detailed information of DEM
+            array(numpy.ndarray or None): float32 array of the grid size to write into, allocated if None
 
         Returns:
-            dict: A dictionary containing mesh code and elevation values (np.array)
+            dict: A dictionary containing mesh code, elevation values (np.array)
         """
         mesh_code = content["mesh_code"]
         meta_data = content["meta_data"]
-        elevation = content["elevation"]["items"]
+        values = content["elevation"]["values"]
 
-        x_length = meta_data["grid_length"]["x"]
-        y_length = meta_data["grid_length"]["y"]
+        x_length = int(meta_data["grid_x"])
+        y_length = int(meta_data["grid_y"])
 
-        array = np.empty((y_length, x_length), np.float32)
-        array.fill(-9999)
+        if array is None:
+            array = np.empty((y_length, x_length), np.float32)
 
-        start_point_x = meta_data["start_point"]["x"]
-        start_point_y = meta_data["start_point"]["y"]
-
-        # Since the data is arranged from the northwest to the southeast,
-        # put the coordinates in the array for each row.
-        index = 0
-        for y in range(start_point_y, y_length):
-            for x in range(start_point_x, x_length):
-                try:
-                    insert_value = float(elevation[index])
-                    array[y][x] = insert_value
-                # The number of rows of data and the size of the grid do not always match
-                except IndexError:
-                    break
-                index += 1
-            start_point_x = 0
+        Dem._fill_tile(
+            array,
+            values,
+            int(meta_data["start_x"]),
+            int(meta_data["start_y"]),
+        )
 
         np_array = {"mesh_code": mesh_code, "np_array": array}
 
         return np_array
 
-    def _store_np_array_list(self):
-        """Create a list of dictionaries containing mesh code and elevation value np.array from Dem"""
-        self.np_array_list = [
-            self._get_np_array(content) for content in self.all_content_list
-        ]
+    def _store_tile_list(self):
+        """Create a list of dictionaries containing mesh code and elevation value np.array,
+        aligned with the records of self.meta_data_array"""
+        grid_shapes = set(
+            zip(
+                self.meta_data_array["grid_y"].tolist(),
+                self.meta_data_array["grid_x"].tolist(),
+            )
+        )
+        if len(grid_shapes) == 1:
+            # Tiles of the same grid size are views of a single allocation
+            tile_arrays = np.empty(
+                (len(self.all_content_list), *grid_shapes.pop()), np.float32
+            )
+        else:
+            tile_arrays = [None] * len(self.all_content_list)
+
+        # Tiles are independent and numpy releases the GIL while copying them
+        with ThreadPoolExecutor() as executor:
+            self.tile_list = list(
+                executor.map(self._get_np_array, self.all_content_list, tile_arrays)
+            )
@@ -21,7 +21,8 @@ class Geotiff:
             np_array,
             x_length,
             y_length,
-            output_path):
+            output_path,
+            creation_options=None):
         """Initializer
 
         Args:
@@ -30,6 +31,7 @@ class Geotiff:
             x_length (int): image size of x
             y_length (int): iamge size of y
             output_path (Path): Path object of file output path
+            creation_options (list or None): GTiff creation options such as "TILED=YES"
 
         Notes:
             The contents of geo_transform list are as follows
@@ -41,6 +43,7 @@ class Geotiff:
         self.x_length = x_length
         self.y_length = y_length
         self.output_path: Path = output_path
+        self.creation_options: list = creation_options or []
 
     def write_raster_bands(
         self,
@@ -105,7 +108,8 @@ class Geotiff:
                 self.x_length,
                 self.y_length,
                 band_count,
-                dtype
+                dtype,
+                options=self.creation_options
             )
             dst_ds.SetGeoTransform(self.geo_transform)
         except AttributeError:
@@ -145,5 +149,6 @@ class Geotiff:
             file_name=file_name,
             epsg=epsg,
             output_path=self.output_path,
-            no_data_value=no_data_value
+            no_data_value=no_data_value,
+            creation_options=self.creation_options
         )
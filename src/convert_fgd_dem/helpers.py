@@ -20,7 +20,8 @@ def warp(
     source_path=None,
     output_path=None,
     epsg="EPSG:3857",
-    no_data_value=-9999
+    no_data_value=-9999,
+    creation_options=None
 ):
     """
     Create new GeoTiff from EPSG: 4326 Tiff
@@ -31,6 +32,7 @@ def warp(
         output_path (Path or None): Path object of file output path
         epsg (str): string of epsg
         no_data_value (int): integer of no data value
+        creation_options (list or None): GTiff creation options of the warped file
     """
 
     if not output_path.exists():
@@ -52,7 +54,8 @@ def warp(
         srcSRS="EPSG:4326",
         dstSRS=epsg,
         dstNodata=no_data_value,
-        resampleAlg="bilinear"
+        resampleAlg="bilinear",
+        creationOptions=creation_options or []
     )
     resampled_ras.FlushCache()
 
@@ -1,6 +1,7 @@
 import unittest
 from pathlib import Path
 
+import numpy as np
 from osgeo import gdal, gdalconst
 
 from src.convert_fgd_dem import Converter
@@ -26,5 +27,38 @@ class TestConverter(unittest.TestCase):
         )
 
 
+    def test_fill_uncovered(self):
+        array = np.zeros((4, 6), np.float32)
+        # Overlapping xml ranges, the last one reaching past the bottom right edge
+        Converter._fill_uncovered(
+            array,
+            row_starts=np.array([0, 1, 2]),
+            row_ends=np.array([2, 3, 6]),
+            column_starts=np.array([0, 2, 5]),
+            column_ends=np.array([3, 5, 8]),
+        )
+        expected = np.array(
+            [
+                [0, 0, 0, -9999, -9999, -9999],
+                [0, 0, 0, 0, 0, -9999],
+                [-9999, -9999, 0, 0, 0, 0],
+                [-9999, -9999, -9999, -9999, -9999, 0],
+            ],
+            np.float32,
+        )
+        np.testing.assert_array_equal(expected, array)
+
+        # A 3x3 mesh of 2x2 xml without the middle one
+        array = np.zeros((6, 6), np.float32)
+        starts = np.array([(row, column) for row in (0, 2, 4) for column in (0, 2, 4)])
+        starts = np.delete(starts, 4, axis=0)
+        Converter._fill_uncovered(
+            array, starts[:, 0], starts[:, 0] + 2, starts[:, 1], starts[:, 1] + 2
+        )
+        expected = np.zeros((6, 6), np.float32)
+        expected[2:4, 2:4] = -9999
+        np.testing.assert_array_equal(expected, array)
+
+
 if __name__ == "__main__":
     unittest.main()
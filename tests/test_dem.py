@@ -1,7 +1,46 @@
+import os
+import tempfile
 import unittest
+import zipfile
 from pathlib import Path
 
+import numpy as np
+
 from src.convert_fgd_dem import Dem
+from src.convert_fgd_dem.helpers import DemInputXmlException
+
+# A 4x2 grid DEM whose values start at the second cell
+DEM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Dataset xmlns:gml="http://www.opengis.net/gml/3.2" xmlns="http://fgd.gsi.go.jp/spec/2008/FGD_GMLSchema">
+<DEM>
+<mesh>64413200</mesh>
+<coverage>
+<gml:boundedBy><gml:Envelope>
+<gml:lowerCorner>42.9 141.25</gml:lowerCorner>
+<gml:upperCorner>42.9083 141.2625</gml:upperCorner>
+</gml:Envelope></gml:boundedBy>
+<gml:gridDomain><gml:Grid><gml:limits><gml:GridEnvelope>
+<gml:low>0 0</gml:low>
+<gml:high>3 1</gml:high>
+</gml:GridEnvelope></gml:limits></gml:Grid></gml:gridDomain>
+<gml:rangeSet><gml:DataBlock>
+<gml:tupleList>
+地表面,352.25
+地表面,354.15
+海水面,-9999.
+地表面,353.50
+地表面,355.00
+地表面,356.75
+地表面,357.10
+</gml:tupleList>
+</gml:DataBlock></gml:rangeSet>
+<gml:coverageFunction><gml:GridFunction>
+<gml:startPoint>1 0</gml:startPoint>
+</gml:GridFunction></gml:coverageFunction>
+</coverage>
+</DEM>
+</Dataset>
+"""
 
 
 class TestDem(unittest.TestCase):
@@ -19,6 +58,98 @@ class TestDem(unittest.TestCase):
         }
         self.assertEqual(bounds_latlng, dem_ins.bounds_latlng)
 
+    def test_check_mesh_codes(self):
+        dem_ins = Dem.__new__(Dem)
+        dem_ins.mesh_code_list = [644132, 644133]
+        dem_ins._check_mesh_codes()
+
+        dem_ins.mesh_code_list = [644132, 64413201]
+        with self.assertRaises(DemInputXmlException):
+            dem_ins._check_mesh_codes()
+
+        dem_ins.mesh_code_list = [644132, 12345]
+        with self.assertRaises(DemInputXmlException):
+            dem_ins._check_mesh_codes()
+
+    def test_fill_tile(self):
+        array = np.zeros((3, 4), np.float32)
+        values = np.arange(1, 8, dtype=np.float32)
+        Dem._fill_tile(array, values, 2, 1)
+        expected = np.array(
+            [
+                [-9999, -9999, -9999, -9999],
+                [-9999, -9999, 1, 2],
+                [3, 4, 5, 6],
+            ],
+            np.float32,
+        )
+        np.testing.assert_array_equal(expected, array)
+
+    def test_parse_tuple_list(self):
+        tuple_list = "\n".join(
+            [
+                "地表面,352.25",
+                "海水面,-9999.",
+                "海水底面,-9999.",
+                "海水底面,-12.50",
+                "内水面,-9999.",
+                "データなし,-9999.",
+            ]
+        )
+        np.testing.assert_array_equal(
+            np.array([352.25, -9999, -9999, -12.5, -9999, -9999], np.float32),
+            Dem._parse_tuple_list(tuple_list),
+        )
+        np.testing.assert_array_equal(
+            np.array([352.25, 0, 0, -12.5, -9999, -9999], np.float32),
+            Dem._parse_tuple_list(tuple_list, sea_at_zero=True),
+        )
+
+
+    def test_content_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_path = Path(tmp_dir) / "FG-GML-6441-32-00-DEM5A.xml"
+            xml_path.write_text(DEM_XML, encoding="utf-8")
+            Dem.clear_cache()
+
+            dem_ins = Dem(xml_path)
+            content = dem_ins.get_xml_content(xml_path)
+            dem_ins.update_cache()
+            # An unchanged file is not read again
+            self.assertIs(content, Dem(xml_path).get_xml_content(xml_path))
+
+            # A modified file is read again
+            stat = xml_path.stat()
+            os.utime(xml_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            modified_content = Dem(xml_path).get_xml_content(xml_path)
+            self.assertIsNot(content, modified_content)
+            np.testing.assert_array_equal(
+                content["elevation"]["values"], modified_content["elevation"]["values"]
+            )
+
+            Dem.clear_cache()
+
+
+    def test_read_zip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = Path(tmp_dir) / "FG-GML-6441-32-DEM5A.zip"
+            with zipfile.ZipFile(zip_path, "w") as zip_file:
+                zip_file.writestr("FG-GML-6441-32-00-DEM5A.xml", DEM_XML)
+                zip_file.writestr("__MACOSX/._FG-GML-6441-32-00-DEM5A.xml", "")
+
+            with Dem(zip_path) as dem_ins:
+                self.assertEqual(1, len(dem_ins.xml_paths))
+                content = dem_ins.get_xml_content(dem_ins.xml_paths[0])
+                zip_file = dem_ins.zip_files[0]
+
+            self.assertEqual(64413200, content["mesh_code"])
+            np.testing.assert_array_equal(
+                np.array([352.25, 354.15, -9999, 353.5, 355, 356.75, 357.1], np.float32),
+                content["elevation"]["values"],
+            )
+            self.assertIsNone(zip_file.fp)
+            self.assertEqual([], dem_ins.zip_files)
+
 
 if __name__ == "__main__":
     unittest.main()